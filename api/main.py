@@ -1,17 +1,21 @@
 import os
+import time
 import joblib
 import pandas as pd
 import logging
-from typing import Optional, List
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from typing import Optional, List, Dict
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
 # Import the crawl function from the scraper script (assuming it's in the parent dir)
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from main import crawl_data, save_to_supabase
+from main import crawl_data, save_to_supabase, refresh_vehicle_stats
+from metrics import metrics, load_published
+from ml.comparables import ComparablesIndex
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -52,17 +56,20 @@ def supabase_request(method, endpoint, params=None, json=None):
         "Authorization": f"Bearer {SUPABASE_KEY}",
         "Content-Type": "application/json"
     }
+    table = endpoint.split("?")[0]
     try:
-        if method == "GET":
-            response = requests.get(url, headers=headers, params=params)
-        elif method == "POST":
-            response = requests.post(url, headers=headers, json=json)
-        else:
-            return None
+        with metrics.timed("api_supabase", method=method, endpoint=table):
+            if method == "GET":
+                response = requests.get(url, headers=headers, params=params)
+            elif method == "POST":
+                response = requests.post(url, headers=headers, json=json)
+            else:
+                return None
             
         response.raise_for_status()
         return response.json()
     except Exception as e:
+        metrics.inc("api_supabase_failures_total", method=method, endpoint=table)
         logging.error(f"Supabase request failed: {e}")
         return None
 
@@ -93,12 +100,41 @@ class Vehicle(BaseModel):
     trim: Optional[str]
     scraped_at: Optional[str]
 
+class Comparable(Vehicle):
+    distance: float
+
+class HistoryInterval(BaseModel):
+    value: Optional[str]
+    valid_from: str
+    valid_to: Optional[str]
+
+class VehicleHistory(BaseModel):
+    vehicle_id: int
+    listing_url: str
+    fields: Dict[str, List[HistoryInterval]]
+
 class Prediction(BaseModel):
     vehicle_id: int
     predicted_price: float
     actual_price: Optional[float]
     difference: Optional[float]
 
+class StatsGroup(BaseModel):
+    key: str
+    count: int
+    min_price: Optional[float]
+    max_price: Optional[float]
+    avg_price: Optional[float]
+    avg_mileage: Optional[float]
+
+class Stats(BaseModel):
+    total: Optional[StatsGroup]
+    by_year: List[StatsGroup]
+    by_trim: List[StatsGroup]
+    by_fuel_type: List[StatsGroup]
+    price_histogram: List[StatsGroup]
+    mileage_histogram: List[StatsGroup]
+
 class SyncStatus(BaseModel):
     status: str
     message: str
@@ -117,6 +153,38 @@ def get_vehicles(limit: int = 100):
         raise HTTPException(status_code=500, detail="Failed to fetch vehicles")
     return data
 
+@app.get("/stats", response_model=Stats)
+def get_stats():
+    """
+    Inventory aggregates and histograms, precomputed by the vehicle_stats materialized view.
+    """
+    data = supabase_request("GET", "vehicle_stats", params={"select": "*"})
+    if data is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch stats")
+
+    groups = {}
+    for row in data:
+        groups.setdefault(row["dimension"], []).append({
+            "key": row["bucket"],
+            "count": row["count"],
+            "min_price": row["min_price"],
+            "max_price": row["max_price"],
+            "avg_price": row["avg_price"],
+            "avg_mileage": row["avg_mileage"],
+        })
+
+    def numeric_order(group):
+        return float(group["key"]) if group["key"].replace(".", "", 1).isdigit() else float("inf")
+
+    return {
+        "total": (groups.get("total") or [None])[0],
+        "by_year": sorted(groups.get("year", []), key=numeric_order),
+        "by_trim": sorted(groups.get("trim", []), key=lambda g: -g["count"]),
+        "by_fuel_type": sorted(groups.get("fuel_type", []), key=lambda g: -g["count"]),
+        "price_histogram": sorted(groups.get("price_histogram", []), key=numeric_order),
+        "mileage_histogram": sorted(groups.get("mileage_histogram", []), key=numeric_order),
+    }
+
 @app.get("/vehicles/{id}", response_model=Vehicle)
 def get_vehicle(id: int):
     """
@@ -131,6 +199,36 @@ def get_vehicle(id: int):
         raise HTTPException(status_code=404, detail="Vehicle not found")
     return data[0]
 
+@app.get("/vehicles/{id}/history", response_model=VehicleHistory)
+def get_vehicle_history(id: int, field: Optional[str] = None):
+    """
+    Value history of a vehicle's fields (or of a single field), oldest first.
+    """
+    data = supabase_request("GET", "vehicles", params={"select": "listing_url", "id": f"eq.{id}"})
+    if not data:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    listing_url = data[0]["listing_url"]
+
+    params = {
+        "select": "field,value,valid_from,valid_to",
+        "listing_url": f"eq.{listing_url}",
+        "order": "field.asc,valid_from.asc"
+    }
+    if field:
+        params["field"] = f"eq.{field}"
+    history = supabase_request("GET", "vehicle_history", params=params)
+    if history is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch vehicle history")
+
+    fields = {}
+    for row in history:
+        fields.setdefault(row["field"], []).append({
+            "value": row["value"],
+            "valid_from": row["valid_from"],
+            "valid_to": row["valid_to"]
+        })
+    return {"vehicle_id": id, "listing_url": listing_url, "fields": fields}
+
 @app.get("/vehicles/{id}/predict", response_model=Prediction)
 def predict_price(id: int):
     """
@@ -172,12 +270,88 @@ def predict_price(id: int):
         "difference": round(prediction - (vehicle.get("price") or 0), 2)
     }
 
+# Comparable-vehicle index, built on first use and kept in step with the vehicles table
+comparables_index = ComparablesIndex()
+comparables_state = {"checked_at": 0.0, "version": None}
+
+# PostgREST caps each response (1000 rows by default on Supabase), so the inventory is read in pages
+VEHICLES_PAGE_SIZE = 1000
+# How often a comparables request may check whether a sync has changed the inventory
+COMPARABLES_CHECK_INTERVAL = 60  # seconds
+
+def fetch_all_vehicles():
+    vehicles = []
+    while True:
+        params = {"select": "*", "order": "id.asc", "limit": VEHICLES_PAGE_SIZE, "offset": len(vehicles)}
+        page = supabase_request("GET", "vehicles", params=params)
+        if page is None:
+            return None
+        vehicles.extend(page)
+        if len(page) < VEHICLES_PAGE_SIZE:
+            return vehicles
+
+def inventory_version():
+    """
+    The newest scraped_at and vehicle_history id. The second one also moves when a
+    cache replay changes fields without a new crawl.
+    """
+    scrape = supabase_request("GET", "vehicles", params={"select": "scraped_at", "order": "scraped_at.desc.nullslast", "limit": 1})
+    change = supabase_request("GET", "vehicle_history", params={"select": "id", "order": "id.desc", "limit": 1})
+    if scrape is None or change is None:
+        return None
+    return (scrape[0]["scraped_at"] if scrape else "", change[0]["id"] if change else 0)
+
+def refresh_comparables_index(version=None):
+    version = version or inventory_version()
+    data = fetch_all_vehicles()
+    if data is None:
+        return False
+    comparables_index.update(data)
+    comparables_state.update(checked_at=time.monotonic(), version=version)
+    return True
+
+def ensure_comparables_index():
+    """Update the index when a sync or replay (from any process) has changed the inventory since it was built"""
+    if time.monotonic() - comparables_state["checked_at"] < COMPARABLES_CHECK_INTERVAL:
+        return True
+    version = inventory_version()
+    if version is None:
+        return False
+    if comparables_index.tree is not None and version == comparables_state["version"]:
+        comparables_state["checked_at"] = time.monotonic()
+        return True
+    return refresh_comparables_index(version)
+
+@app.get("/vehicles/{id}/comparables", response_model=List[Comparable])
+def get_comparables(id: int, k: int = Query(5, ge=1, le=50)):
+    """
+    The k most similar vehicles by year, mileage, price, trim and fuel type.
+    """
+    if not ensure_comparables_index():
+        raise HTTPException(status_code=500, detail="Failed to build comparables index")
+    results = comparables_index.query(id, k)
+    if results is None:
+        # Only rebuild for vehicles that exist but were added since the last check
+        data = supabase_request("GET", "vehicles", params={"select": "id", "id": f"eq.{id}"})
+        if data is None:
+            raise HTTPException(status_code=500, detail="Failed to fetch vehicle")
+        if not data:
+            raise HTTPException(status_code=404, detail="Vehicle not found")
+        if not refresh_comparables_index():
+            raise HTTPException(status_code=500, detail="Failed to build comparables index")
+        results = comparables_index.query(id, k)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    return [{**vehicle, "distance": round(distance, 4)} for vehicle, distance in results]
+
 def run_sync_job():
     logging.info("Starting manual sync job...")
     try:
         vehicles = crawl_data()
         if vehicles:
             save_to_supabase(vehicles)
+            refresh_vehicle_stats()
+            refresh_comparables_index()
         logging.info("Manual sync job completed.")
     except Exception as e:
         logging.error(f"Manual sync failed: {e}")
@@ -190,6 +364,14 @@ def trigger_sync(background_tasks: BackgroundTasks):
     background_tasks.add_task(run_sync_job)
     return {"status": "started", "message": "Scraper job has been triggered in the background."}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Crawl and API metrics in the Prometheus text format, including those published
+    to METRICS_DIR by the scheduler and queue workers.
+    """
+    return metrics.render_prometheus(load_published())
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,156 @@
+"""
+Per-URL crawl traces and an offline profiling report.
+
+A trace is a JSONL file with one event per visited URL: stage timings, HTTP
+status, response sizes, attempt number, the fields that were extracted and,
+optionally, the rendered page text for later replay.
+
+Usage:
+    python crawl_trace.py report trace.jsonl [--top 20]
+    python crawl_trace.py compare before.jsonl after.jsonl [--top 20]
+"""
+import json
+import time
+import uuid
+import argparse
+import threading
+
+
+class CrawlTrace:
+    """Append-only JSONL writer for trace events"""
+
+    def __init__(self, path, capture_text=False):
+        self.path = path
+        self.capture_text = capture_text
+        self.run_id = time.strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:6]
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def new_event(self, dealer, kind, url, attempt=1):
+        return {
+            'run_id': self.run_id,
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'dealer': dealer,
+            'kind': kind,
+            'url': url,
+            'attempt': attempt,
+            'timings': {},
+            '_started': time.perf_counter(),
+        }
+
+    def write(self, event):
+        event = dict(event)
+        event['total_s'] = round(time.perf_counter() - event.pop('_started'), 4)
+        if not self.capture_text:
+            event.pop('text', None)
+        with self.lock:
+            self.file.write(json.dumps(event, ensure_ascii=False) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load_events(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def stage_stats(events):
+    """Total, mean, p50 and p95 seconds per stage, plus the end-to-end time per URL"""
+    samples = {}
+    for event in events:
+        for stage, seconds in event.get('timings', {}).items():
+            samples.setdefault(stage, []).append(seconds)
+        samples.setdefault('total', []).append(event.get('total_s', 0.0))
+    return {
+        stage: {
+            'count': len(values),
+            'total_s': round(sum(values), 2),
+            'mean_s': round(sum(values) / len(values), 3),
+            'p50_s': round(_percentile(values, 50), 3),
+            'p95_s': round(_percentile(values, 95), 3),
+        }
+        for stage, values in samples.items()
+    }
+
+
+def status_counts(events):
+    counts = {}
+    for event in events:
+        counts[event.get('status', 'unknown')] = counts.get(event.get('status', 'unknown'), 0) + 1
+    return counts
+
+
+def _slowest_stage(event):
+    timings = event.get('timings') or {}
+    return max(timings, key=timings.get) if timings else '-'
+
+
+def print_report(events, top=20):
+    runs = sorted({e.get('run_id') for e in events})
+    retries = sum(1 for e in events if e.get('attempt', 1) > 1)
+    print(f"{len(events)} events from {len(runs)} run(s), {retries} retries, status: {status_counts(events)}")
+
+    print(f"\n{'stage':<20}{'count':>7}{'total s':>10}{'mean s':>9}{'p50 s':>9}{'p95 s':>9}")
+    stats = stage_stats(events)
+    for stage, s in sorted(stats.items(), key=lambda item: -item[1]['total_s']):
+        print(f"{stage:<20}{s['count']:>7}{s['total_s']:>10}{s['mean_s']:>9}{s['p50_s']:>9}{s['p95_s']:>9}")
+
+    print(f"\nSlowest {top} URLs:")
+    for event in sorted(events, key=lambda e: -e.get('total_s', 0.0))[:top]:
+        print(f"  {event.get('total_s', 0.0):>8.2f}s  {event.get('status', '?'):<8} "
+              f"slowest={_slowest_stage(event):<14} {event['url']}")
+
+
+def print_comparison(before, after, top=20):
+    print(f"status before: {status_counts(before)}")
+    print(f"status after:  {status_counts(after)}")
+
+    before_stats, after_stats = stage_stats(before), stage_stats(after)
+    print(f"\n{'stage':<20}{'p50 before':>12}{'p50 after':>11}{'p95 before':>12}{'p95 after':>11}{'total delta s':>15}")
+    for stage in sorted(set(before_stats) | set(after_stats)):
+        b = before_stats.get(stage, {'p50_s': 0.0, 'p95_s': 0.0, 'total_s': 0.0})
+        a = after_stats.get(stage, {'p50_s': 0.0, 'p95_s': 0.0, 'total_s': 0.0})
+        print(f"{stage:<20}{b['p50_s']:>12}{a['p50_s']:>11}{b['p95_s']:>12}{a['p95_s']:>11}{round(a['total_s'] - b['total_s'], 2):>15}")
+
+    # Per-URL regressions, using the last attempt of each URL in each trace
+    before_by_url = {e['url']: e for e in before}
+    after_by_url = {e['url']: e for e in after}
+    deltas = [
+        (after_by_url[url].get('total_s', 0.0) - before_by_url[url].get('total_s', 0.0), url)
+        for url in set(before_by_url) & set(after_by_url)
+    ]
+    print(f"\nBiggest per-URL regressions (of {len(deltas)} URLs in both traces):")
+    for delta, url in sorted(deltas, reverse=True)[:top]:
+        print(f"  {delta:+8.2f}s  {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl trace profiling report")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="Rank the slowest URLs and stages of a trace")
+    report.add_argument("trace")
+    report.add_argument("--top", type=int, default=20)
+    compare = sub.add_parser("compare", help="Compare two traces stage by stage")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print_report(load_events(args.trace), args.top)
+    else:
+        print_comparison(load_events(args.before), load_events(args.after), args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Multi-dealer crawler.
+
+All registered dealers are crawled at once over a single Chromium instance.
+A fixed pool of browser pages pulls work from a scheduler that keeps one queue
+per host and hands out jobs round-robin, so a slow dealer only ever ties up
+its own share of the pool. Each host is throttled by a token bucket and a cap
+on in-flight pages. Failed pages are re-queued with backoff, and a per-host
+circuit breaker pauses a degraded site instead of hammering it (see
+resilience.py).
+"""
+import heapq
+import asyncio
+import time
+import logging
+from collections import deque
+from playwright.async_api import async_playwright
+
+from dealers import load_dealers
+from metrics import metrics
+from page_cache import store_page
+from resilience import AdaptiveTimeout, CircuitBreaker, retry_delay, DEFAULT_MAX_ATTEMPTS
+from playwright_scraper import collect_listing_urls, extract_vehicle_details, has_vehicle_data
+
+logger = logging.getLogger(__name__)
+
+# Number of browser pages shared by all dealers
+DEFAULT_POOL_SIZE = 4
+# A host whose circuit opens this many times in one crawl is skipped for the rest of it
+MAX_BREAKER_TRIPS = 4
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average, with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        """Take a token if one is available"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """Seconds until the next token is available"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class HostScheduler:
+    """Per-host job queues served round-robin under each host's rate limit and circuit breaker"""
+
+    def __init__(self):
+        self.queues = {}
+        self.deferred = {}
+        self.buckets = {}
+        self.breakers = {}
+        self.timeouts = {}
+        self.limits = {}
+        self.names = {}
+        self.in_flight = {}
+        self.order = deque()
+        self.changed = asyncio.Condition()
+        self.seq = 0
+
+    def add_host(self, dealer):
+        host = dealer['host']
+        if host in self.queues:
+            return
+        self.queues[host] = deque()
+        self.deferred[host] = []
+        self.buckets[host] = TokenBucket(dealer['rate_per_sec'], dealer['burst'])
+        self.breakers[host] = CircuitBreaker(host)
+        self.timeouts[host] = AdaptiveTimeout()
+        self.limits[host] = dealer['max_concurrency']
+        self.names[host] = dealer['name']
+        self.in_flight[host] = 0
+        self.order.append(host)
+
+    async def put(self, dealer, kind, url, attempt=1, delay=0):
+        """Queue a job, or defer it by `delay` seconds when it is a retry"""
+        self.add_host(dealer)
+        job = (dealer, kind, url, attempt)
+        if delay:
+            self.seq += 1
+            heapq.heappush(self.deferred[dealer['host']], (time.monotonic() + delay, self.seq, job))
+        else:
+            self.queues[dealer['host']].append(job)
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def done(self, host):
+        self.in_flight[host] -= 1
+        async with self.changed:
+            self.changed.notify_all()
+
+    def _pending(self):
+        return any(self.queues.values()) or any(self.deferred.values()) or any(self.in_flight.values())
+
+    def _promote_due(self, host):
+        """Move retries whose backoff has elapsed into the host's ready queue"""
+        deferred = self.deferred[host]
+        now = time.monotonic()
+        while deferred and deferred[0][0] <= now:
+            self.queues[host].append(heapq.heappop(deferred)[2])
+        return deferred[0][0] - now if deferred else None
+
+    def _abandon_if_tripped(self, host):
+        """Give up on a host whose breaker keeps re-opening"""
+        if self.breakers[host].trips < MAX_BREAKER_TRIPS:
+            return
+        dropped = len(self.queues[host]) + len(self.deferred[host])
+        if dropped:
+            logger.error(f"Giving up on {host}: circuit opened {self.breakers[host].trips} times, dropping {dropped} URLs")
+            metrics.inc('crawl_failures_total', dropped, reason='circuit_open', dealer=self.names[host])
+            self.queues[host].clear()
+            self.deferred[host].clear()
+
+    def _next_ready(self):
+        """Pick the next host in rotation that has work, a free slot, a closed circuit and a token"""
+        waits = []
+        for _ in range(len(self.order)):
+            host = self.order[0]
+            self.order.rotate(-1)
+            self._abandon_if_tripped(host)
+            retry_wait = self._promote_due(host)
+            if retry_wait is not None:
+                waits.append(retry_wait)
+            if not self.queues[host] or self.in_flight[host] >= self.limits[host]:
+                continue
+            breaker = self.breakers[host]
+            if not breaker.ready():
+                # While a probe is in flight there is nothing to wait for; done() wakes us when it finishes
+                breaker_wait = breaker.wait_time()
+                if breaker_wait is not None:
+                    waits.append(breaker_wait)
+                continue
+            if self.buckets[host].try_acquire():
+                breaker.allow()
+                self.in_flight[host] += 1
+                return self.queues[host].popleft(), None
+            waits.append(self.buckets[host].wait_time())
+        return None, min(waits) if waits else None
+
+    async def get(self):
+        """Return the next job, or None once every queue is drained"""
+        async with self.changed:
+            while True:
+                job, wait = self._next_ready()
+                if job:
+                    return job
+                if not self._pending():
+                    return None
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+
+async def _retry_or_drop(scheduler, dealer, kind, url, attempt, reason):
+    if attempt >= DEFAULT_MAX_ATTEMPTS:
+        # A page counts as failed once, when it is dropped; failed attempts are in crawl_attempt_failures_total
+        logger.warning(f"[{dealer['name']}] Giving up on {url} after {attempt} attempts ({reason})")
+        metrics.inc('crawl_failures_total', reason=reason, dealer=dealer['name'])
+        return
+    delay = retry_delay(attempt)
+    logger.info(f"[{dealer['name']}] Retrying {url} in {delay:.0f}s (attempt {attempt} failed: {reason})")
+    metrics.inc('crawl_retries_total', dealer=dealer['name'])
+    await scheduler.put(dealer, kind, url, attempt=attempt + 1, delay=delay)
+
+
+async def _worker(worker_id, context, scheduler, vehicles, trace=None, cache=None):
+    page = await context.new_page()
+    while True:
+        job = await scheduler.get()
+        if job is None:
+            break
+        dealer, kind, url, attempt = job
+        host = dealer['host']
+        breaker, timeout = scheduler.breakers[host], scheduler.timeouts[host]
+        # Timings are always collected for the adaptive timeout; the event is only written when tracing
+        event = trace.new_event(dealer['name'], kind, url, attempt) if trace else {}
+        try:
+            # Only the requests to the host belong in here: whatever this block raises counts against its breaker
+            try:
+                if kind == 'inventory':
+                    listing_urls = await collect_listing_urls(page, dealer, event)
+                    event.update(status='ok', listings=len(listing_urls))
+                else:
+                    event['timeout_ms'] = timeout.current_ms()
+                    vehicle_data = await extract_vehicle_details(page, url, dealer, event, timeout=event['timeout_ms'], raise_errors=True)
+                breaker.record_success()
+            except Exception as e:
+                breaker.record_failure()
+                if kind == 'inventory':
+                    metrics.inc('crawl_attempt_failures_total', reason=type(e).__name__, dealer=dealer['name'])
+                    logger.error(f"Worker {worker_id} failed on {url}: {e}")
+                    event.update(status='error', error=f"{type(e).__name__}: {e}"[:300])
+                await _retry_or_drop(scheduler, dealer, kind, url, attempt, type(e).__name__)
+                continue
+
+            if kind == 'inventory':
+                for listing_url in listing_urls:
+                    await scheduler.put(dealer, 'detail', listing_url)
+            else:
+                if cache is not None:
+                    store_page(cache, url, event['text'], dealer['name'])
+                if has_vehicle_data(vehicle_data):
+                    vehicles.append(vehicle_data)
+                    logger.info(f"[{dealer['name']}] -> {vehicle_data.get('title', 'No title')[:40]} - ${vehicle_data.get('price', 'N/A')}")
+                else:
+                    logger.warning(f"[{dealer['name']}] -> No data extracted from {url}")
+                    await _retry_or_drop(scheduler, dealer, kind, url, attempt, 'no_data')
+        finally:
+            if kind == 'detail' and 'navigation' in event.get('timings', {}):
+                timeout.observe(event['timings']['navigation'])
+            if trace:
+                trace.write(event)
+            await scheduler.done(host)
+    await page.close()
+
+
+async def crawl_dealers(dealers=None, pool_size=DEFAULT_POOL_SIZE, trace=None, cache=None):
+    """Crawl every dealer's inventory concurrently and return the extracted vehicles.
+
+    If a CrawlTrace is given, one trace event is written per visited URL; if a
+    PageCache is given, the rendered text of every detail page is stored in it.
+    """
+    dealers = dealers or load_dealers()
+    scheduler = HostScheduler()
+    for dealer in dealers:
+        await scheduler.put(dealer, 'inventory', dealer['inventory_url'])
+
+    vehicles = []
+    run_start = metrics.snapshot()
+    async with async_playwright() as p:
+        with metrics.timed('browser_launch'):
+            browser = await p.chromium.launch(headless=True)
+            context = await browser.new_context()
+        await asyncio.gather(*(
+            _worker(i, context, scheduler, vehicles, trace, cache) for i in range(pool_size)
+        ))
+        await browser.close()
+
+    logger.info(f"Extracted complete data for {len(vehicles)} vehicles from {len(dealers)} dealers")
+    metrics.log_summary(since=run_start)
+    return vehicles
@@ -19,6 +19,24 @@ interface Vehicle {
   scraped_at: string;
 }
 
+interface StatsGroup {
+  key: string;
+  count: number;
+  min_price: number | null;
+  max_price: number | null;
+  avg_price: number | null;
+  avg_mileage: number | null;
+}
+
+interface Stats {
+  total: StatsGroup | null;
+  by_year: StatsGroup[];
+  by_trim: StatsGroup[];
+  by_fuel_type: StatsGroup[];
+  price_histogram: StatsGroup[];
+  mileage_histogram: StatsGroup[];
+}
+
 interface Prediction {
   vehicle_id: number;
   predicted_price: number;
@@ -31,13 +49,28 @@ export default function Home() {
   const [loading, setLoading] = useState(true);
   const [syncing, setSyncing] = useState(false);
   const [predictions, setPredictions] = useState<{ [key: number]: Prediction }>({});
+  const [stats, setStats] = useState<Stats | null>(null);
 
   const API_URL = "http://localhost:8000";
 
   useEffect(() => {
     fetchVehicles();
+    fetchStats();
   }, []);
 
+  const fetchStats = async () => {
+    try {
+      const res = await fetch(`${API_URL}/stats`);
+      if (res.ok) {
+        setStats(await res.json());
+      } else {
+        console.error("Failed to fetch stats");
+      }
+    } catch (error) {
+      console.error("Error fetching stats:", error);
+    }
+  };
+
   const fetchVehicles = async () => {
     setLoading(true);
     try {
@@ -110,6 +143,25 @@ export default function Home() {
           </button>
         </header>
 
+        {stats?.total && (
+          <div className="grid grid-cols-2 md:grid-cols-4 gap-4 mb-8">
+            {[
+              { label: "Vehicles", value: stats.total.count.toLocaleString() },
+              { label: "Average Price", value: `$${stats.total.avg_price?.toLocaleString() ?? "-"}` },
+              {
+                label: "Price Range",
+                value: `$${stats.total.min_price?.toLocaleString() ?? "-"} - $${stats.total.max_price?.toLocaleString() ?? "-"}`,
+              },
+              { label: "Average Mileage", value: `${stats.total.avg_mileage?.toLocaleString() ?? "-"} km` },
+            ].map((card) => (
+              <div key={card.label} className="rounded-xl border border-gray-800 bg-gray-900/50 p-4">
+                <p className="text-gray-400 text-xs uppercase">{card.label}</p>
+                <p className="text-xl font-bold mt-1">{card.value}</p>
+              </div>
+            ))}
+          </div>
+        )}
+
         {loading ? (
           <div className="text-center py-20">
             <div className="animate-spin rounded-full h-12 w-12 border-b-2 border-blue-500 mx-auto mb-4"></div>
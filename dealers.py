@@ -0,0 +1,70 @@
+"""
+Dealer registry.
+
+Each dealer entry describes where its used inventory lives, which site adapter
+knows how to walk its listing pages, and any field patterns that differ from
+the defaults. Extra dealers can be added here or loaded from a JSON file
+pointed to by the DEALERS_FILE environment variable.
+"""
+import os
+import json
+import logging
+from urllib.parse import urlparse
+
+# Field patterns used by the detail page parser when a dealer does not override them
+DEFAULT_FIELD_PATTERNS = {
+    'fuel_types': ['Essence', 'Diesel', 'Électrique', 'Hybride', 'Gasoline', 'Electric', 'Hybrid'],
+    'trims': ['Technik', 'Komfort', 'Progressiv', 'Premium', 'Sport', 'S line', 'Quattro'],
+    'make': 'Audi',
+}
+
+# Default crawl politeness for a single host
+DEFAULT_RATE_PER_SEC = 0.5
+DEFAULT_BURST = 2
+DEFAULT_MAX_CONCURRENCY = 1
+
+DEALERS = [
+    {
+        'name': 'audi_west_island',
+        'inventory_url': 'https://www.audiwestisland.com/fr/inventaire/occasion/',
+        'website_url': 'https://www.audiwestisland.com',
+        'adapter': 'dealer_inventory',
+        'field_patterns': {},
+    },
+]
+
+
+def normalize_dealer(dealer):
+    """Fill in defaults for optional dealer settings"""
+    inventory_url = dealer['inventory_url']
+    parsed = urlparse(inventory_url)
+    normalized = dict(dealer)
+    normalized.setdefault('name', parsed.netloc)
+    normalized.setdefault('website_url', f"{parsed.scheme}://{parsed.netloc}")
+    normalized.setdefault('adapter', 'dealer_inventory')
+    normalized.setdefault('rate_per_sec', DEFAULT_RATE_PER_SEC)
+    normalized.setdefault('burst', DEFAULT_BURST)
+    normalized.setdefault('max_concurrency', DEFAULT_MAX_CONCURRENCY)
+    normalized['host'] = parsed.netloc
+    normalized['field_patterns'] = {**DEFAULT_FIELD_PATTERNS, **(dealer.get('field_patterns') or {})}
+    return normalized
+
+
+def load_dealers(path=None):
+    """Return the normalized dealer list, from a JSON file if one is configured"""
+    path = path or os.getenv("DEALERS_FILE")
+    dealers = DEALERS
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            dealers = json.load(f)
+        logging.info(f"Loaded {len(dealers)} dealers from {path}")
+    return [normalize_dealer(d) for d in dealers]
+
+
+def dealer_for_url(url, dealers=None):
+    """Find the dealer whose host serves the given URL"""
+    host = urlparse(url).netloc
+    for dealer in dealers or load_dealers():
+        if dealer['host'] == host:
+            return dealer
+    raise KeyError(f"No dealer registered for host: {host}")
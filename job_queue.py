@@ -0,0 +1,199 @@
+"""
+Durable job queue with visibility-timeout leases.
+
+Workers lease jobs for a fixed time. A job that is not acked before its lease
+expires becomes visible again, so a killed worker never loses work. Failed
+jobs are retried with exponential backoff and moved to a dead-letter state
+once they run out of attempts.
+
+SQLite is the built-in backend and is safe for many processes on one machine.
+Other backends (for workers on several machines) register themselves in
+QUEUE_BACKENDS and are selected by the scheme of CRAWL_QUEUE_URL.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+from urllib.parse import urlparse
+
+DEFAULT_QUEUE_URL = "sqlite:///crawl_queue.db"
+DEFAULT_VISIBILITY_TIMEOUT = 600  # seconds
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BACKOFF = 60  # seconds, doubled on every failed attempt
+
+
+class JobQueue:
+    """Interface every queue backend implements. Jobs are dicts with id, payload and attempts."""
+
+    def enqueue(self, payloads, queue='default'):
+        """Add payloads, skipping ones already pending. Returns the number added."""
+        raise NotImplementedError
+
+    def lease(self, worker_id, limit=1, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, queue='default'):
+        """Hide up to `limit` ready jobs from other workers and return them"""
+        raise NotImplementedError
+
+    def extend(self, job_ids, worker_id, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        """Push back the lease expiry of jobs the worker still holds"""
+        raise NotImplementedError
+
+    def ack(self, job_ids):
+        """Mark jobs as done"""
+        raise NotImplementedError
+
+    def fail(self, job_id, error, backoff=DEFAULT_BACKOFF):
+        """Schedule a retry, or dead-letter the job when it is out of attempts. Returns True if it was dead-lettered."""
+        raise NotImplementedError
+
+    def release(self, job_ids, delay=0):
+        """Give leased jobs back without using up an attempt, e.g. when the failure was not theirs"""
+        raise NotImplementedError
+
+    def requeue_dead(self, queue='default'):
+        """Give dead-lettered jobs a fresh set of attempts"""
+        raise NotImplementedError
+
+    def stats(self, queue='default'):
+        """Job counts by status"""
+        raise NotImplementedError
+
+
+class SQLiteJobQueue(JobQueue):
+    def __init__(self, path, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            create table if not exists jobs (
+              id integer primary key autoincrement,
+              queue text not null,
+              job_key text not null,
+              payload text not null,
+              status text not null default 'ready', -- ready | leased | done | dead
+              attempts integer not null default 0,
+              available_at real not null,
+              lease_owner text,
+              leased_until real,
+              last_error text,
+              updated_at real not null,
+              unique (queue, job_key)
+            );
+            create index if not exists jobs_ready_idx on jobs (queue, status, available_at);
+        """)
+
+    def enqueue(self, payloads, queue='default'):
+        now = time.time()
+        rows = [(queue, json.dumps(p, sort_keys=True), json.dumps(p), now, now) for p in payloads]
+        before = self.conn.total_changes
+        # Finished jobs are reset so the next crawl picks them up again; pending ones are left alone
+        self.conn.executemany("""
+            insert into jobs (queue, job_key, payload, available_at, updated_at)
+            values (?, ?, ?, ?, ?)
+            on conflict (queue, job_key) do update set
+              status = 'ready', attempts = 0, last_error = null,
+              available_at = excluded.available_at, updated_at = excluded.updated_at
+            where jobs.status in ('done', 'dead')
+        """, rows)
+        return self.conn.total_changes - before
+
+    def lease(self, worker_id, limit=1, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, queue='default'):
+        now = time.time()
+        self.conn.execute("begin immediate")
+        try:
+            # Leases that expired on their last attempt go straight to the dead-letter state
+            self.conn.execute("""
+                update jobs set status = 'dead', last_error = coalesce(last_error, 'lease expired'), updated_at = ?
+                where queue = ? and status = 'leased' and leased_until < ? and attempts >= ?
+            """, (now, queue, now, self.max_attempts))
+            rows = self.conn.execute("""
+                select id, payload, attempts from jobs
+                where queue = ?
+                  and ((status = 'ready' and available_at <= ?) or (status = 'leased' and leased_until < ?))
+                order by available_at, id
+                limit ?
+            """, (queue, now, now, limit)).fetchall()
+            self.conn.executemany("""
+                update jobs set status = 'leased', lease_owner = ?, leased_until = ?,
+                  attempts = attempts + 1, updated_at = ?
+                where id = ?
+            """, [(worker_id, now + visibility_timeout, now, r['id']) for r in rows])
+            self.conn.execute("commit")
+        except Exception:
+            self.conn.execute("rollback")
+            raise
+        return [{'id': r['id'], 'payload': json.loads(r['payload']), 'attempts': r['attempts'] + 1} for r in rows]
+
+    def extend(self, job_ids, worker_id, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        now = time.time()
+        self.conn.executemany("""
+            update jobs set leased_until = ?, updated_at = ?
+            where id = ? and status = 'leased' and lease_owner = ?
+        """, [(now + visibility_timeout, now, job_id, worker_id) for job_id in job_ids])
+
+    def ack(self, job_ids):
+        now = time.time()
+        self.conn.executemany(
+            "update jobs set status = 'done', lease_owner = null, leased_until = null, updated_at = ? where id = ?",
+            [(now, job_id) for job_id in job_ids]
+        )
+
+    def fail(self, job_id, error, backoff=DEFAULT_BACKOFF):
+        now = time.time()
+        row = self.conn.execute("select attempts from jobs where id = ?", (job_id,)).fetchone()
+        if not row:
+            return False
+        if row['attempts'] >= self.max_attempts:
+            logging.warning(f"Job {job_id} dead-lettered after {row['attempts']} attempts: {error}")
+            status, available_at = 'dead', now
+        else:
+            status, available_at = 'ready', now + backoff * 2 ** (row['attempts'] - 1)
+        self.conn.execute("""
+            update jobs set status = ?, available_at = ?, last_error = ?,
+              lease_owner = null, leased_until = null, updated_at = ?
+            where id = ?
+        """, (status, available_at, str(error)[:500], now, job_id))
+        return status == 'dead'
+
+    def release(self, job_ids, delay=0):
+        now = time.time()
+        self.conn.executemany("""
+            update jobs set status = 'ready', attempts = max(attempts - 1, 0), available_at = ?,
+              lease_owner = null, leased_until = null, updated_at = ?
+            where id = ? and status = 'leased'
+        """, [(now + delay, now, job_id) for job_id in job_ids])
+
+    def requeue_dead(self, queue='default'):
+        now = time.time()
+        cursor = self.conn.execute("""
+            update jobs set status = 'ready', attempts = 0, available_at = ?, updated_at = ?
+            where queue = ? and status = 'dead'
+        """, (now, now, queue))
+        return cursor.rowcount
+
+    def stats(self, queue='default'):
+        rows = self.conn.execute(
+            "select status, count(*) as n from jobs where queue = ? group by status", (queue,)
+        ).fetchall()
+        return {r['status']: r['n'] for r in rows}
+
+
+def _open_sqlite(parsed):
+    # sqlite:///relative.db and sqlite:////absolute/path.db, like SQLAlchemy URLs
+    return SQLiteJobQueue(parsed.path[1:] or 'crawl_queue.db')
+
+
+QUEUE_BACKENDS = {
+    'sqlite': _open_sqlite,
+}
+
+
+def open_queue(url=None):
+    """Open the queue named by a URL such as sqlite:///crawl_queue.db"""
+    url = url or os.getenv("CRAWL_QUEUE_URL", DEFAULT_QUEUE_URL)
+    parsed = urlparse(url)
+    if parsed.scheme not in QUEUE_BACKENDS:
+        raise ValueError(f"Unsupported queue backend: {parsed.scheme}")
+    return QUEUE_BACKENDS[parsed.scheme](parsed)
@@ -23,15 +23,33 @@ load_dotenv()
 FIRECRAWL_API_KEY = os.getenv("FIRECRAWL_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-TARGET_URL = "https://www.audiwestisland.com/fr/inventaire/occasion/"
+UPSERT_CHUNK_SIZE = 500
+# Opt-in per-URL trace (JSONL path); CRAWL_TRACE_TEXT=1 also stores the rendered text
+CRAWL_TRACE = os.getenv("CRAWL_TRACE")
+CRAWL_TRACE_TEXT = os.getenv("CRAWL_TRACE_TEXT") == "1"
 
 import asyncio
-from playwright_scraper import scrape_audi_inventory
+from dealers import load_dealers
+from crawler import crawl_dealers
+from metrics import metrics, publish
+from crawl_trace import CrawlTrace
+from page_cache import open_cache
+from playwright_scraper import VEHICLE_FIELDS
 
 def crawl_data():
     logging.info("Starting crawl job using Playwright Scraper...")
     try:
-        vehicles = asyncio.run(scrape_audi_inventory())
+        dealers = load_dealers()
+        logging.info(f"Crawling {len(dealers)} dealers: {', '.join(d['name'] for d in dealers)}")
+        trace = CrawlTrace(CRAWL_TRACE, capture_text=CRAWL_TRACE_TEXT) if CRAWL_TRACE else None
+        cache = open_cache()
+        try:
+            vehicles = asyncio.run(crawl_dealers(dealers, trace=trace, cache=cache))
+        finally:
+            if trace:
+                trace.close()
+        if cache:
+            cache.evict()
         logging.info(f"Crawl completed. Found {len(vehicles)} unique vehicles.")
         return vehicles
     except Exception as e:
@@ -41,7 +59,7 @@ def crawl_data():
 def save_to_supabase(vehicles):
     if not vehicles:
         logging.info("No vehicles to save.")
-        return
+        return True
 
     logging.info("Saving data to Supabase...")
     
@@ -59,7 +77,8 @@ def save_to_supabase(vehicles):
         normalized = {}
         for key in expected_keys:
             if key == 'scraped_at':
-                normalized[key] = current_time
+                # Extracted and replayed pages carry the time they were crawled at
+                normalized[key] = v.get('scraped_at') or current_time
             else:
                 normalized[key] = v.get(key)  # None if missing
         
@@ -72,7 +91,7 @@ def save_to_supabase(vehicles):
     
     if not vehicles_to_upsert:
         logging.info("No unique vehicles to save.")
-        return
+        return True
 
     logging.info(f"deduplicated from {len(vehicles)} to {len(vehicles_to_upsert)} unique vehicles.")
 
@@ -87,19 +106,67 @@ def save_to_supabase(vehicles):
     }
 
     try:
-        # Batch upsert
-        response = requests.post(url, headers=headers, json=vehicles_to_upsert)
-        response.raise_for_status()
+        # Batch upsert, in chunks to keep each request small
+        for start in range(0, len(vehicles_to_upsert), UPSERT_CHUNK_SIZE):
+            chunk = vehicles_to_upsert[start:start + UPSERT_CHUNK_SIZE]
+            with metrics.timed('upsert_chunk'):
+                response = requests.post(url, headers=headers, json=chunk)
+            metrics.inc('supabase_upserted_rows_total', len(chunk))
+            response.raise_for_status()
         logging.info("Successfully saved data to Supabase.")
+        record_vehicle_history(vehicles_to_upsert)
+        return True
     except Exception as e:
+        metrics.inc('supabase_upsert_failures_total')
         logging.error(f"Error saving to Supabase: {e}")
         if 'response' in locals():
             logging.error(f"Response content: {response.text}")
+        return False
+
+def record_vehicle_history(vehicles):
+    """Append changed field values to vehicle_history in bulk (see record_vehicle_history in schema.sql)"""
+    url = f"{SUPABASE_URL}/rest/v1/rpc/record_vehicle_history"
+    headers = {
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "Content-Type": "application/json",
+    }
+    try:
+        changes = 0
+        for start in range(0, len(vehicles), UPSERT_CHUNK_SIZE):
+            chunk = vehicles[start:start + UPSERT_CHUNK_SIZE]
+            with metrics.timed('history_chunk'):
+                response = requests.post(url, headers=headers, json={"snapshots": chunk, "tracked_fields": VEHICLE_FIELDS})
+            response.raise_for_status()
+            changes += response.json() or 0
+        logging.info(f"Recorded {changes} changed values in vehicle history.")
+    except Exception as e:
+        # The latest state is already saved; a missed night only coarsens the history
+        logging.error(f"Error recording vehicle history: {e}")
+
+def refresh_vehicle_stats():
+    """Refresh the vehicle_stats materialized view behind the API's /stats endpoint"""
+    url = f"{SUPABASE_URL}/rest/v1/rpc/refresh_vehicle_stats"
+    headers = {
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "Content-Type": "application/json",
+    }
+    try:
+        with metrics.timed('stats_refresh'):
+            response = requests.post(url, headers=headers, json={})
+        response.raise_for_status()
+        logging.info("Refreshed vehicle stats.")
+    except Exception as e:
+        # Stale stats are not worth failing the sync over
+        logging.error(f"Error refreshing vehicle stats: {e}")
 
 def job():
     vehicles = crawl_data()
     if vehicles:
         save_to_supabase(vehicles)
+        refresh_vehicle_stats()
+    publish('scheduler')
 
 def main():
     logging.info("Scheduler started. Job will run every day at 00:00.")
@@ -0,0 +1,222 @@
+"""
+In-process crawl and API metrics.
+
+Counters and histograms are kept in a single module-level registry and can be
+rendered in the Prometheus text format (served by the API at /metrics) or
+summarized for a single crawl run by diffing against a snapshot taken when
+the run started.
+
+Crawls mostly run outside the API process (the main.py scheduler, worker.py).
+When METRICS_DIR is set they publish their registry there after every run,
+and the API renders those files alongside its own, tagged with a `source`
+label.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, spanning a regex pass to a slow page load
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Published registries older than this are ignored and cleaned up (e.g. from workers that exited)
+PUBLISHED_MAX_AGE = 7 * 86400
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist['buckets'][i] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    @contextmanager
+    def timed(self, stage, trace_event=None, **labels):
+        """Record the duration of a block in the stage_seconds histogram (and in a trace event, if given)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('stage_seconds', elapsed, stage=stage, **labels)
+            if trace_event is not None:
+                timings = trace_event.setdefault('timings', {})
+                timings[stage] = round(timings.get(stage, 0.0) + elapsed, 4)
+
+    def snapshot(self):
+        """Copy of the current values, used as the starting point of a run summary"""
+        with self.lock:
+            return {
+                'time': time.monotonic(),
+                'counters': dict(self.counters),
+                'histograms': {k: (h['sum'], h['count']) for k, h in self.histograms.items()},
+            }
+
+    def summary(self, since=None):
+        """Per-run totals since a snapshot: pages/sec, bytes, failures, field fill-rate and stage timings"""
+        since = since or {'time': None, 'counters': {}, 'histograms': {}}
+        now = self.snapshot()
+        counters = {k: v - since['counters'].get(k, 0) for k, v in now['counters'].items()}
+
+        def total(name):
+            return sum(v for (n, _), v in counters.items() if n == name)
+
+        def by_label(name, label):
+            # Sum over the other labels, e.g. failures of the same reason across dealers
+            totals = {}
+            for (n, labels), v in counters.items():
+                if n == name and v:
+                    key = dict(labels)[label]
+                    totals[key] = totals.get(key, 0) + v
+            return totals
+
+        pages = total('crawl_pages_total')
+        elapsed = now['time'] - since['time'] if since['time'] else None
+        stages = {}
+        for (name, labels), (total_s, count) in now['histograms'].items():
+            prev_sum, prev_count = since['histograms'].get((name, labels), (0.0, 0))
+            count -= prev_count
+            if name != 'stage_seconds' or not count:
+                continue
+            stage = dict(labels)['stage']
+            entry = stages.setdefault(stage, {'count': 0, 'total_s': 0.0})
+            entry['count'] += count
+            entry['total_s'] += total_s - prev_sum
+        for entry in stages.values():
+            entry['mean_s'] = round(entry['total_s'] / entry['count'], 4)
+            entry['total_s'] = round(entry['total_s'], 3)
+
+        return {
+            'elapsed_s': round(elapsed, 1) if elapsed else None,
+            'pages': pages,
+            'pages_per_sec': round(pages / elapsed, 3) if elapsed else None,
+            'bytes': total('crawl_bytes_total'),
+            'failures': by_label('crawl_failures_total', 'reason'),
+            'attempt_failures': by_label('crawl_attempt_failures_total', 'reason'),
+            'field_fill_rate': {f: round(n / pages, 3) for f, n in by_label('crawl_fields_filled_total', 'field').items()} if pages else {},
+            'stages': stages,
+        }
+
+    def log_summary(self, since=None):
+        summary = self.summary(since)
+        logging.info(f"Run summary: {summary['pages']} pages in {summary['elapsed_s']}s "
+                     f"({summary['pages_per_sec']} pages/s, {summary['bytes']} bytes), failures: {summary['failures']}, "
+                     f"failed attempts: {summary['attempt_failures']}")
+        for stage, entry in sorted(summary['stages'].items(), key=lambda s: -s[1]['total_s']):
+            logging.info(f"  {stage:<16} n={entry['count']:<6} total={entry['total_s']}s mean={entry['mean_s']}s")
+        logging.info(f"  field fill-rate: {summary['field_fill_rate']}")
+        return summary
+
+    def export(self, path, **labels):
+        """Write the registry to a JSON file, with `labels` added to every series"""
+        with self.lock:
+            data = {
+                'buckets': list(self.buckets),
+                'counters': [[name, dict(key, **labels), value] for (name, key), value in self.counters.items()],
+                'histograms': [[name, dict(key, **labels), hist] for (name, key), hist in self.histograms.items()],
+            }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """A registry written by export()"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        registry = cls(tuple(data['buckets']))
+        registry.counters = {_key(name, labels): value for name, labels, value in data['counters']}
+        registry.histograms = {_key(name, labels): hist for name, labels, hist in data['histograms']}
+        return registry
+
+    def render_prometheus(self, others=()):
+        """Current values in the Prometheus text exposition format, merged with other registries"""
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{str(v)}"' for k, v in pairs) + '}'
+
+        lines = []
+        counters, histograms = [], []
+        for registry in (self, *others):
+            with registry.lock:
+                counters.extend(registry.counters.items())
+                histograms.extend((k, registry.buckets, dict(h, buckets=list(h['buckets']))) for k, h in registry.histograms.items())
+        counters.sort()
+        histograms.sort(key=lambda h: h[0])
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{fmt_labels(labels)} {value}")
+        for (name, labels), buckets, hist in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for bound, count in zip(buckets, hist['buckets']):
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {hist['count']}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {hist['sum']}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {hist['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def publish(source):
+    """Write this process's metrics to METRICS_DIR for the API to serve; a no-op when it is not set"""
+    directory = os.getenv("METRICS_DIR")
+    if not directory:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        metrics.export(os.path.join(directory, f"{source}.json"), source=source)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.json') and os.path.getmtime(path) < time.time() - PUBLISHED_MAX_AGE:
+                os.remove(path)
+    except OSError as e:
+        logging.error(f"Failed to publish metrics to {directory}: {e}")
+
+
+def load_published():
+    """Registries published by crawl processes into METRICS_DIR"""
+    directory = os.getenv("METRICS_DIR")
+    if not directory or not os.path.isdir(directory):
+        return []
+    registries = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith('.json') or os.path.getmtime(path) < time.time() - PUBLISHED_MAX_AGE:
+            continue
+        try:
+            registries.append(Metrics.load(path))
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Skipping unreadable metrics file {path}: {e}")
+    return registries
@@ -0,0 +1,109 @@
+"""
+Nearest-neighbour index for comparable-vehicle search.
+
+Vehicles are mapped to feature vectors with the same imputation, scaling and
+one-hot encoding as the price model (see train_model.build_preprocessor) and
+indexed in a KD-tree. Updates are incremental: only vehicles whose features
+changed are re-encoded, and the preprocessor is only refit when new
+categories appear or the inventory has grown or shrunk substantially.
+"""
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+from ml.train_model import build_preprocessor
+
+COMPARABLE_NUMERIC_FEATURES = ['year', 'mileage', 'price']
+COMPARABLE_CATEGORICAL_FEATURES = ['trim', 'fuel_type']
+
+# Refit the scaler once the inventory size drifts this far from the last fit
+REFIT_DRIFT = 0.2
+
+
+def _signature(vehicle):
+    return tuple(vehicle.get(f) for f in COMPARABLE_NUMERIC_FEATURES + COMPARABLE_CATEGORICAL_FEATURES)
+
+
+class ComparablesIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.preprocessor = None
+        self.fitted_size = 0
+        self.categories = {}
+        self.vehicles = {}
+        self.signatures = {}
+        self.vectors = {}
+        self.ids = []
+        self.tree = None
+
+    def _frame(self, vehicles):
+        return pd.DataFrame(
+            [{f: v.get(f) for f in COMPARABLE_NUMERIC_FEATURES + COMPARABLE_CATEGORICAL_FEATURES} for v in vehicles],
+            columns=COMPARABLE_NUMERIC_FEATURES + COMPARABLE_CATEGORICAL_FEATURES
+        ).astype({f: float for f in COMPARABLE_NUMERIC_FEATURES})
+
+    def _transform(self, vehicles):
+        matrix = self.preprocessor.transform(self._frame(vehicles))
+        return matrix.toarray() if hasattr(matrix, 'toarray') else np.asarray(matrix)
+
+    def _needs_refit(self, vehicles):
+        if self.preprocessor is None:
+            return True
+        if abs(len(vehicles) - self.fitted_size) > REFIT_DRIFT * max(self.fitted_size, 1):
+            return True
+        return any(
+            v.get(f) is not None and v.get(f) not in self.categories[f]
+            for v in vehicles for f in COMPARABLE_CATEGORICAL_FEATURES
+        )
+
+    def update(self, vehicles):
+        """Bring the index in line with the given inventory. Returns the number of re-encoded vehicles."""
+        vehicles = [v for v in vehicles if v.get('id') is not None]
+        current = {v['id']: v for v in vehicles}
+        with self.lock:
+            changed = [v for v in vehicles if self.signatures.get(v['id']) != _signature(v)]
+            removed = set(self.vehicles) - set(current)
+            if not changed and not removed:
+                return 0
+            if not vehicles:
+                self.vehicles, self.signatures, self.vectors, self.ids, self.tree = {}, {}, {}, [], None
+                return 0
+
+            if self._needs_refit(vehicles):
+                self.preprocessor = build_preprocessor(COMPARABLE_NUMERIC_FEATURES, COMPARABLE_CATEGORICAL_FEATURES)
+                self.preprocessor.fit(self._frame(vehicles))
+                self.fitted_size = len(vehicles)
+                self.categories = {f: {v.get(f) for v in vehicles} for f in COMPARABLE_CATEGORICAL_FEATURES}
+                self.vectors = {}
+                changed = vehicles
+
+            if changed:
+                for vehicle, vector in zip(changed, self._transform(changed)):
+                    self.vectors[vehicle['id']] = vector
+                    self.signatures[vehicle['id']] = _signature(vehicle)
+            for vehicle_id in removed:
+                self.vectors.pop(vehicle_id, None)
+                self.signatures.pop(vehicle_id, None)
+
+            self.vehicles = current
+            self.ids = list(current)
+            self.tree = KDTree(np.vstack([self.vectors[i] for i in self.ids])) if self.ids else None
+
+        logging.info(f"Comparables index updated: {len(changed)} re-encoded, {len(removed)} removed, {len(self.ids)} indexed")
+        return len(changed)
+
+    def query(self, vehicle_id, k=5):
+        """The k nearest vehicles to the given one, as (vehicle, distance) pairs, or None if it isn't indexed"""
+        with self.lock:
+            if self.tree is None or vehicle_id not in self.vectors:
+                return None
+            # Ask for one extra neighbour since the vehicle itself is always the nearest
+            distances, indices = self.tree.query(self.vectors[vehicle_id].reshape(1, -1), k=min(k + 1, len(self.ids)))
+            neighbours = [
+                (self.vehicles[self.ids[i]], float(d))
+                for d, i in zip(distances[0], indices[0])
+                if self.ids[i] != vehicle_id
+            ]
+            return neighbours[:k]
@@ -47,6 +47,28 @@ def fetch_data():
         logging.error(f"Error fetching data: {e}")
         return None
 
+# Features used by the price model
+NUMERIC_FEATURES = ['year', 'mileage']
+CATEGORICAL_FEATURES = ['fuel_type', 'transmission', 'exterior_color', 'trim'] # engine might be too high cardinality or dirty
+
+def build_preprocessor(numeric_features=NUMERIC_FEATURES, categorical_features=CATEGORICAL_FEATURES):
+    """Impute and scale numeric columns, impute and one-hot encode categorical ones"""
+    numeric_transformer = Pipeline(steps=[
+        ('imputer', SimpleImputer(strategy='median')),
+        ('scaler', StandardScaler())
+    ])
+
+    categorical_transformer = Pipeline(steps=[
+        ('imputer', SimpleImputer(strategy='constant', fill_value='missing')),
+        ('onehot', OneHotEncoder(handle_unknown='ignore'))
+    ])
+
+    return ColumnTransformer(
+        transformers=[
+            ('num', numeric_transformer, numeric_features),
+            ('cat', categorical_transformer, categorical_features)
+        ])
+
 def train_model():
     df = fetch_data()
     if df is None or df.empty:
@@ -65,28 +87,11 @@ def train_model():
     df = df.dropna(subset=[target])
     
     # Features
-    numeric_features = ['year', 'mileage']
-    categorical_features = ['fuel_type', 'transmission', 'exterior_color', 'trim'] # engine might be too high cardinality or dirty
-    
-    X = df[numeric_features + categorical_features]
+    X = df[NUMERIC_FEATURES + CATEGORICAL_FEATURES]
     y = df[target]
 
     # Preprocessing Pipeline
-    numeric_transformer = Pipeline(steps=[
-        ('imputer', SimpleImputer(strategy='median')),
-        ('scaler', StandardScaler())
-    ])
-
-    categorical_transformer = Pipeline(steps=[
-        ('imputer', SimpleImputer(strategy='constant', fill_value='missing')),
-        ('onehot', OneHotEncoder(handle_unknown='ignore'))
-    ])
-
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ('num', numeric_transformer, numeric_features),
-            ('cat', categorical_transformer, categorical_features)
-        ])
+    preprocessor = build_preprocessor()
 
     # Model Pipeline
     model = Pipeline(steps=[
@@ -0,0 +1,215 @@
+"""
+Rendered-page cache and replay.
+
+The rendered innerText of every detail page is stored on disk, gzip
+compressed and content-addressed (identical pages on different nights share
+one object), with an index keyed by URL and crawl date. Replay re-runs the
+extraction over cached pages and re-upserts the results, so a parser fix can
+be applied to the whole inventory without visiting the dealer sites again.
+
+Usage:
+    python page_cache.py replay [--date YYYY-MM-DD] [--dry-run]
+    python page_cache.py evict
+    python page_cache.py stats
+"""
+import os
+import gzip
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+
+DEFAULT_CACHE_DIR = "page_cache"
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+class PageCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR, ttl_days=DEFAULT_TTL_DAYS, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.ttl_days = ttl_days
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.db'), timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            create table if not exists pages (
+              url text not null,
+              crawl_date text not null,
+              dealer text,
+              digest text not null,
+              size integer not null, -- compressed bytes
+              stored_at real not null,
+              primary key (url, crawl_date)
+            );
+            create index if not exists pages_digest_idx on pages (digest);
+            create index if not exists pages_stored_at_idx on pages (stored_at);
+        """)
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest + '.gz')
+
+    def put(self, url, text, dealer=None, crawl_date=None):
+        """Store the rendered text of a page for today's (or the given) crawl date"""
+        crawl_date = crawl_date or time.strftime('%Y-%m-%d')
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        self.conn.execute(
+            "insert or replace into pages (url, crawl_date, dealer, digest, size, stored_at) values (?, ?, ?, ?, ?, ?)",
+            (url, crawl_date, dealer, digest, os.path.getsize(path), time.time())
+        )
+        return digest
+
+    def _read(self, digest):
+        with gzip.open(self._object_path(digest), 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def get(self, url, crawl_date=None):
+        """Cached text for a URL on a crawl date (latest date if omitted), or None"""
+        if crawl_date:
+            row = self.conn.execute("select digest from pages where url = ? and crawl_date = ?", (url, crawl_date)).fetchone()
+        else:
+            row = self.conn.execute("select digest from pages where url = ? order by crawl_date desc limit 1", (url,)).fetchone()
+        if not row:
+            return None
+        try:
+            return self._read(row['digest'])
+        except FileNotFoundError:
+            return None
+
+    def latest_date(self):
+        """Most recent crawl date in the cache, or None when it is empty"""
+        return self.conn.execute("select max(crawl_date) from pages").fetchone()[0]
+
+    def iter_pages(self, crawl_date=None):
+        """Yield (url, dealer, stored_at, text) for every page of a crawl date, or the latest copy of every URL.
+
+        stored_at is the epoch time the page was rendered and cached.
+        """
+        if crawl_date:
+            rows = self.conn.execute("select url, dealer, stored_at, digest from pages where crawl_date = ?", (crawl_date,)).fetchall()
+        else:
+            rows = self.conn.execute("""
+                select url, dealer, stored_at, digest from pages p
+                where crawl_date = (select max(crawl_date) from pages where url = p.url)
+            """).fetchall()
+        for row in rows:
+            try:
+                yield row['url'], row['dealer'], row['stored_at'], self._read(row['digest'])
+            except FileNotFoundError:
+                logging.warning(f"Cached object missing for {row['url']}")
+
+    def evict(self):
+        """Drop entries past the TTL, then the oldest entries until under the size limit"""
+        expired = self.conn.execute(
+            "delete from pages where stored_at < ?", (time.time() - self.ttl_days * 86400,)
+        ).rowcount
+        rows = self.conn.execute("""
+            select digest, size, max(stored_at) as last_used from pages group by digest order by last_used
+        """).fetchall()
+        total = sum(r['size'] for r in rows)
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("delete from pages where digest = ?", (row['digest'],))
+            total -= row['size']
+
+        # Remove objects no index entry points to any more
+        live = {r['digest'] for r in self.conn.execute("select distinct digest from pages")}
+        removed = 0
+        objects_dir = os.path.join(self.root, 'objects')
+        for prefix in os.listdir(objects_dir):
+            for name in os.listdir(os.path.join(objects_dir, prefix)):
+                if name.endswith('.gz') and name[:-3] not in live:
+                    os.remove(os.path.join(objects_dir, prefix, name))
+                    removed += 1
+        logging.info(f"Page cache eviction: {expired} expired entries, {removed} objects removed, {total} bytes in use")
+        return removed
+
+    def stats(self):
+        row = self.conn.execute("""
+            select count(*) as pages, count(distinct url) as urls, count(distinct crawl_date) as dates,
+                   count(distinct digest) as objects
+            from pages
+        """).fetchone()
+        size = self.conn.execute("select coalesce(sum(size), 0) from (select distinct digest, size from pages)").fetchone()[0]
+        return {**dict(row), 'bytes': size}
+
+
+def open_cache():
+    """The cache configured by PAGE_CACHE_DIR, or None when caching is off"""
+    root = os.getenv("PAGE_CACHE_DIR")
+    return PageCache(root) if root else None
+
+
+def store_page(cache, url, text, dealer=None):
+    """Put a page in the cache, logging instead of raising: a full disk must not fail a page that was crawled fine"""
+    try:
+        cache.put(url, text, dealer)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Failed to cache {url}: {e}")
+
+
+def replay(cache, crawl_date=None, dry_run=False):
+    """Re-run extraction over the pages of a crawl date (the latest by default) and upsert the results.
+
+    Upserting an older crawl would overwrite newer rows (and record the old
+    values as fresh changes in vehicle_history), so that is only allowed as a
+    dry run; URLs missing from the latest crawl are not replayed either. Replayed
+    rows keep the time their page was crawled as scraped_at, which is never
+    earlier than the scraped_at the crawl itself saved.
+    """
+    from main import save_to_supabase, refresh_vehicle_stats
+    from dealers import load_dealers, dealer_for_url
+    from playwright_scraper import parse_vehicle_text, has_vehicle_data
+
+    latest = cache.latest_date()
+    crawl_date = crawl_date or latest
+    if crawl_date != latest and not dry_run:
+        logging.error(f"Refusing to upsert pages from {crawl_date}: the latest cached crawl is {latest}. Use --dry-run to inspect older crawls.")
+        return []
+
+    dealers = load_dealers()
+    by_name = {d['name']: d for d in dealers}
+    vehicles = []
+    started = time.perf_counter()
+    for url, dealer_name, stored_at, text in cache.iter_pages(crawl_date):
+        dealer = by_name.get(dealer_name) or dealer_for_url(url, dealers)
+        vehicle_data = parse_vehicle_text(text, url, dealer)
+        vehicle_data['scraped_at'] = time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(stored_at))
+        if has_vehicle_data(vehicle_data):
+            vehicles.append(vehicle_data)
+    logging.info(f"Replayed {len(vehicles)} vehicles from cache in {time.perf_counter() - started:.1f}s")
+    if not dry_run and save_to_supabase(vehicles):
+        refresh_vehicle_stats()
+    return vehicles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rendered-page cache")
+    parser.add_argument("command", choices=["replay", "evict", "stats"])
+    parser.add_argument("--dir", default=os.getenv("PAGE_CACHE_DIR", DEFAULT_CACHE_DIR))
+    parser.add_argument("--date", help="Crawl date to replay (default: the latest crawl; older dates need --dry-run)")
+    parser.add_argument("--dry-run", action="store_true", help="Parse but do not upsert")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    cache = PageCache(args.dir)
+    if args.command == "replay":
+        replay(cache, args.date, args.dry_run)
+    elif args.command == "evict":
+        cache.evict()
+    print(cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,29 @@
 import asyncio
-from playwright.async_api import async_playwright
 import logging
+import time
 import re
 
+from dealers import load_dealers
+from metrics import metrics
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Site adapters: how to walk a dealer's inventory listing page
+ADAPTERS = {
+    'dealer_inventory': {
+        'link_selector': 'a[href*="vehicleId"]',
+        'load_more_selector': 'button:has-text("Voir plus"), button:has-text("Load more"), button:has-text("Afficher plus")',
+        'max_scroll_attempts': 20,
+        'initial_wait_ms': 10000,
+        'detail_wait_ms': 5000,
+    },
+}
+
+# Fields the detail page parser tries to fill, used for fill-rate metrics and tracked in vehicle_history
+VEHICLE_FIELDS = ['title', 'vin', 'price', 'mileage', 'year', 'fuel_type',
+                  'transmission', 'exterior_color', 'engine', 'trim']
+
 def clean_number(text):
     """Remove all non-digit characters except decimal point"""
     if not text:
@@ -17,162 +35,225 @@ def clean_number(text):
     except:
         return None
 
-async def extract_vehicle_details(page, listing_url):
-    """Navigate to a vehicle detail page and extract all available data"""
+def default_dealer():
+    """The first registered dealer, used when callers don't pass one"""
+    return load_dealers()[0]
+
+def parse_vehicle_text(page_text, listing_url, dealer=None):
+    """Extract vehicle fields from the rendered text of a detail page"""
+    dealer = dealer or default_dealer()
+    patterns = dealer['field_patterns']
+    make = re.escape(patterns['make'])
+
+    # Normalize whitespace (replace non-breaking spaces with regular spaces)
+    page_text = page_text.replace('\xa0', ' ')
+    lower_text = page_text.lower()
+
+    data = {
+        'listing_url': listing_url,
+        'website_url': dealer['website_url']
+    }
+
+    # Extract VIN (pattern: 17 alphanumeric characters)
+    vin_match = re.search(r'(?:VIN|Numéro de série|No de série)[:\s]*([A-HJ-NPR-Z0-9]{17})', page_text, re.IGNORECASE)
+    if vin_match:
+        data['vin'] = vin_match.group(1)
+    else:
+        vin_pattern = re.search(r'\b([A-HJ-NPR-Z0-9]{17})\b', page_text)
+        if vin_pattern:
+            data['vin'] = vin_pattern.group(1)
+
+    # Extract Year
+    year_match = re.search(rf'\b(20[1-2][0-9])\b.*{make}|{make}.*\b(20[1-2][0-9])\b', page_text)
+    if year_match:
+        data['year'] = int(year_match.group(1) or year_match.group(2))
+    else:
+        year_alt = re.search(r'(?:Année|Year)[:\s]*(\d{4})', page_text, re.IGNORECASE)
+        if year_alt:
+            data['year'] = int(year_alt.group(1))
+
+    # Extract Title
+    title_match = re.search(rf'(20[1-2][0-9]\s+{make}\s+[A-Za-z0-9\-\s]+)', page_text)
+    if title_match:
+        data['title'] = title_match.group(1).strip()[:100]  # Limit length
+
+    # Extract Price - handle all whitespace types
+    price_match = re.search(r'(\d[\d\s\xa0,]*)\s*\$|\$\s*(\d[\d\s\xa0,]*)', page_text)
+    if price_match:
+        price_str = price_match.group(1) or price_match.group(2)
+        data['price'] = clean_number(price_str)
+
+    # Extract Mileage
+    mileage_match = re.search(r'(\d[\d\s\xa0]*)\s*(?:km|Kilomètres|Kilométrage)', page_text, re.IGNORECASE)
+    if mileage_match:
+        data['mileage'] = clean_number(mileage_match.group(1))
+
+    # Extract Fuel Type
+    for fuel in patterns['fuel_types']:
+        if fuel.lower() in lower_text:
+            data['fuel_type'] = fuel
+            break
+
+    # Extract Transmission
+    if 'automatique' in lower_text or 'automatic' in lower_text:
+        data['transmission'] = 'Automatique'
+    elif 'manuelle' in lower_text or 'manual' in lower_text:
+        data['transmission'] = 'Manuelle'
+
+    # Extract Exterior Color
+    color_match = re.search(r'(?:Couleur extérieure|Exterior Color|Couleur)[:\s]*([A-Za-zÀ-ÿ\s]+?)(?:\n|,|$)', page_text, re.IGNORECASE)
+    if color_match:
+        data['exterior_color'] = color_match.group(1).strip()[:50]
+
+    # Extract Engine
+    engine_match = re.search(r'(?:Moteur|Engine)[:\s]*([^\n]{3,50})', page_text, re.IGNORECASE)
+    if engine_match:
+        data['engine'] = engine_match.group(1).strip()
+    else:
+        engine_alt = re.search(r'(\d+[.,]\d+\s*L|\d+\s*cylindres?)', page_text, re.IGNORECASE)
+        if engine_alt:
+            data['engine'] = engine_alt.group(1).strip()
+
+    # Extract Trim
+    for trim in patterns['trims']:
+        if trim.lower() in lower_text:
+            data['trim'] = trim
+            break
+
+    return data
+
+async def _body_size(response):
+    """Size of the downloaded document; content-length is usually missing on chunked or compressed pages"""
+    if response is None:
+        return None
     try:
-        await page.goto(listing_url, timeout=30000)
-        await page.wait_for_timeout(5000)  # Wait for JS to render
-        
-        page_text = await page.evaluate("() => document.body.innerText")
-        # Normalize whitespace (replace non-breaking spaces with regular spaces)
-        page_text = page_text.replace('\xa0', ' ')
-        
-        data = {
-            'listing_url': listing_url,
-            'website_url': 'https://www.audiwestisland.com'
-        }
-        
-        # Extract VIN (pattern: 17 alphanumeric characters)
-        vin_match = re.search(r'(?:VIN|Numéro de série|No de série)[:\s]*([A-HJ-NPR-Z0-9]{17})', page_text, re.IGNORECASE)
-        if vin_match:
-            data['vin'] = vin_match.group(1)
-        else:
-            vin_pattern = re.search(r'\b([A-HJ-NPR-Z0-9]{17})\b', page_text)
-            if vin_pattern:
-                data['vin'] = vin_pattern.group(1)
-        
-        # Extract Year
-        year_match = re.search(r'\b(20[1-2][0-9])\b.*Audi|Audi.*\b(20[1-2][0-9])\b', page_text)
-        if year_match:
-            data['year'] = int(year_match.group(1) or year_match.group(2))
-        else:
-            year_alt = re.search(r'(?:Année|Year)[:\s]*(\d{4})', page_text, re.IGNORECASE)
-            if year_alt:
-                data['year'] = int(year_alt.group(1))
-        
-        # Extract Title
-        title_match = re.search(r'(20[1-2][0-9]\s+Audi\s+[A-Za-z0-9\-\s]+)', page_text)
-        if title_match:
-            data['title'] = title_match.group(1).strip()[:100]  # Limit length
-        
-        # Extract Price - handle all whitespace types
-        price_match = re.search(r'(\d[\d\s\xa0,]*)\s*\$|\$\s*(\d[\d\s\xa0,]*)', page_text)
-        if price_match:
-            price_str = price_match.group(1) or price_match.group(2)
-            data['price'] = clean_number(price_str)
-        
-        # Extract Mileage
-        mileage_match = re.search(r'(\d[\d\s\xa0]*)\s*(?:km|Kilomètres|Kilométrage)', page_text, re.IGNORECASE)
-        if mileage_match:
-            data['mileage'] = clean_number(mileage_match.group(1))
-        
-        # Extract Fuel Type
-        fuel_patterns = ['Essence', 'Diesel', 'Électrique', 'Hybride', 'Gasoline', 'Electric', 'Hybrid']
-        for fuel in fuel_patterns:
-            if fuel.lower() in page_text.lower():
-                data['fuel_type'] = fuel
-                break
-        
-        # Extract Transmission
-        if 'automatique' in page_text.lower() or 'automatic' in page_text.lower():
-            data['transmission'] = 'Automatique'
-        elif 'manuelle' in page_text.lower() or 'manual' in page_text.lower():
-            data['transmission'] = 'Manuelle'
-        
-        # Extract Exterior Color
-        color_match = re.search(r'(?:Couleur extérieure|Exterior Color|Couleur)[:\s]*([A-Za-zÀ-ÿ\s]+?)(?:\n|,|$)', page_text, re.IGNORECASE)
-        if color_match:
-            data['exterior_color'] = color_match.group(1).strip()[:50]
-        
-        # Extract Engine
-        engine_match = re.search(r'(?:Moteur|Engine)[:\s]*([^\n]{3,50})', page_text, re.IGNORECASE)
-        if engine_match:
-            data['engine'] = engine_match.group(1).strip()
-        else:
-            engine_alt = re.search(r'(\d+[.,]\d+\s*L|\d+\s*cylindres?)', page_text, re.IGNORECASE)
-            if engine_alt:
-                data['engine'] = engine_alt.group(1).strip()
-        
-        # Extract Trim
-        trim_patterns = ['Technik', 'Komfort', 'Progressiv', 'Premium', 'Sport', 'S line', 'Quattro']
-        for trim in trim_patterns:
-            if trim.lower() in page_text.lower():
-                data['trim'] = trim
-                break
-        
+        return len(await response.body())
+    except Exception:
+        # The body is not available for redirects and some navigations; it is only needed for the trace
+        return None
+
+async def extract_vehicle_details(page, listing_url, dealer=None, trace_event=None, timeout=30000, raise_errors=False):
+    """Navigate to a vehicle detail page and extract all available data.
+
+    When a trace_event dict is passed, per-stage timings, response sizes, the
+    extracted field names and the rendered text are recorded into it. Errors
+    return a URL-only stub unless raise_errors is set, so callers that retry
+    can tell a failed page from one without data.
+    """
+    dealer = dealer or default_dealer()
+    adapter = ADAPTERS[dealer['adapter']]
+    event = trace_event if trace_event is not None else {}
+    try:
+        with metrics.timed('navigation', event, dealer=dealer['name']):
+            response = await page.goto(listing_url, timeout=timeout)
+        with metrics.timed('render_wait', event, dealer=dealer['name']):
+            await page.wait_for_timeout(adapter['detail_wait_ms'])  # Wait for JS to render
+
+        with metrics.timed('text_fetch', event, dealer=dealer['name']):
+            page_text = await page.evaluate("() => document.body.innerText")
+        with metrics.timed('extraction', event, dealer=dealer['name']):
+            data = parse_vehicle_text(page_text, listing_url, dealer)
+        # Stamped when the page is read, before it is cached, so a replay of the cached page never goes back in time
+        data['scraped_at'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+
+        text_bytes = len(page_text.encode('utf-8'))
+        metrics.inc('crawl_pages_total', dealer=dealer['name'])
+        metrics.inc('crawl_bytes_total', text_bytes, dealer=dealer['name'])
+        for field in VEHICLE_FIELDS:
+            if data.get(field) is not None:
+                metrics.inc('crawl_fields_filled_total', field=field)
+        if not has_vehicle_data(data):
+            metrics.inc('crawl_attempt_failures_total', reason='no_data', dealer=dealer['name'])
+
+        if trace_event is not None:
+            event['status'] = 'ok' if has_vehicle_data(data) else 'no_data'
+            event['http_status'] = response.status if response else None
+            event['html_bytes'] = await _body_size(response)
+            event['text_bytes'] = text_bytes
+            event['fields'] = [f for f in VEHICLE_FIELDS if data.get(f) is not None]
+            event['text'] = page_text
         return data
-        
+
     except Exception as e:
         logger.warning(f"Error extracting details from {listing_url}: {e}")
-        return {'listing_url': listing_url, 'website_url': 'https://www.audiwestisland.com'}
+        metrics.inc('crawl_attempt_failures_total', reason=type(e).__name__, dealer=dealer['name'])
+        event['status'] = 'error'
+        event['error'] = f"{type(e).__name__}: {e}"[:300]
+        if raise_errors:
+            raise
+        return {'listing_url': listing_url, 'website_url': dealer['website_url']}
+
 
+async def collect_listing_urls(page, dealer=None, trace_event=None):
+    """Scroll the dealer's inventory page and click Load More to gather every detail URL"""
+    dealer = dealer or default_dealer()
+    adapter = ADAPTERS[dealer['adapter']]
 
-async def scrape_audi_inventory():
-    """Scrape all vehicles by scrolling, then visit each detail page for complete data"""
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page()
-        
-        url = "https://www.audiwestisland.com/fr/inventaire/occasion/"
-        logger.info(f"Navigating to {url}")
+    url = dealer['inventory_url']
+    logger.info(f"Navigating to {url}")
+    with metrics.timed('listing_navigation', trace_event, dealer=dealer['name']):
         await page.goto(url, timeout=60000)
-        await page.wait_for_timeout(10000)
-        
-        # Scroll and click Load More to get all vehicle URLs
-        all_vehicle_urls = set()
-        max_scroll_attempts = 20
-        scroll_attempt = 0
-        
-        while scroll_attempt < max_scroll_attempts:
-            links = await page.evaluate('''() => {
-                const allLinks = Array.from(document.querySelectorAll('a[href*="vehicleId"]'));
-                return allLinks.map(a => a.href);
-            }''')
-            
-            new_links = set(links) - all_vehicle_urls
-            all_vehicle_urls.update(links)
-            
-            logger.info(f"Scroll {scroll_attempt}: Found {len(new_links)} new vehicles, total: {len(all_vehicle_urls)}")
-            
-            if len(new_links) == 0 and scroll_attempt > 2:
-                load_more = await page.query_selector('button:has-text("Voir plus"), button:has-text("Load more"), button:has-text("Afficher plus")')
-                if load_more:
-                    logger.info("Found 'Load More' button, clicking...")
-                    try:
-                        await load_more.click()
-                        await page.wait_for_timeout(3000)
-                        scroll_attempt -= 1
-                    except:
-                        pass
-                else:
-                    logger.info("No more content to load")
-                    break
-            
+        await page.wait_for_timeout(adapter['initial_wait_ms'])
+
+    # Scroll and click Load More to get all vehicle URLs
+    all_vehicle_urls = set()
+    max_scroll_attempts = adapter['max_scroll_attempts']
+    scroll_attempt = 0
+
+    while scroll_attempt < max_scroll_attempts:
+        links = await page.evaluate('''(selector) => {
+            const allLinks = Array.from(document.querySelectorAll(selector));
+            return allLinks.map(a => a.href);
+        }''', adapter['link_selector'])
+
+        new_links = set(links) - all_vehicle_urls
+        all_vehicle_urls.update(links)
+
+        logger.info(f"[{dealer['name']}] Scroll {scroll_attempt}: Found {len(new_links)} new vehicles, total: {len(all_vehicle_urls)}")
+
+        if len(new_links) == 0 and scroll_attempt > 2:
+            load_more = await page.query_selector(adapter['load_more_selector'])
+            if load_more:
+                logger.info("Found 'Load More' button, clicking...")
+                try:
+                    await load_more.click()
+                    await page.wait_for_timeout(3000)
+                    scroll_attempt -= 1
+                except:
+                    pass
+            else:
+                logger.info("No more content to load")
+                break
+
+        with metrics.timed('listing_scroll', trace_event, dealer=dealer['name']):
             await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
             await page.wait_for_timeout(2000)
-            scroll_attempt += 1
-        
-        logger.info(f"=== Found {len(all_vehicle_urls)} vehicle URLs. Now extracting detailed data... ===")
-        
-        # Visit each vehicle detail page to extract complete data
-        vehicles = []
-        for i, vehicle_url in enumerate(all_vehicle_urls):
-            logger.info(f"Extracting vehicle {i+1}/{len(all_vehicle_urls)}")
-            vehicle_data = await extract_vehicle_details(page, vehicle_url)
-            
-            # Only add if we got meaningful data
-            if vehicle_data.get('price') or vehicle_data.get('title') or vehicle_data.get('vin'):
-                vehicles.append(vehicle_data)
-                logger.info(f"  -> {vehicle_data.get('title', 'No title')[:40]} - ${vehicle_data.get('price', 'N/A')}")
-            else:
-                logger.warning(f"  -> No data extracted")
-            
-            await page.wait_for_timeout(500)
-        
-        await browser.close()
-        
-        logger.info(f"Extracted complete data for {len(vehicles)} vehicles")
-        return vehicles
+        scroll_attempt += 1
+
+    logger.info(f"=== [{dealer['name']}] Found {len(all_vehicle_urls)} vehicle URLs ===")
+    return sorted(all_vehicle_urls)
+
+
+def has_vehicle_data(vehicle_data):
+    """Only keep records where we got meaningful data"""
+    return bool(vehicle_data.get('price') or vehicle_data.get('title') or vehicle_data.get('vin'))
+
+
+async def scrape_audi_inventory(dealer=None, trace_path=None, capture_text=False):
+    """Scrape all vehicles for one dealer by scrolling, then visit each detail page for complete data.
+
+    Pass trace_path to write one JSONL trace event per URL (see crawl_trace.py).
+    """
+    # Imported here because the crawler builds on the helpers in this module
+    from crawler import crawl_dealers
+    from crawl_trace import CrawlTrace
+
+    trace = CrawlTrace(trace_path, capture_text=capture_text) if trace_path else None
+    try:
+        return await crawl_dealers([dealer or default_dealer()], trace=trace)
+    finally:
+        if trace:
+            trace.close()
 
 
 if __name__ == "__main__":
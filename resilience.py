@@ -0,0 +1,120 @@
+"""
+Failure handling for the crawler: adaptive navigation timeouts, a per-host
+circuit breaker and retry backoff.
+
+Timeouts follow the latency the host has actually shown (p95 of recent
+navigations times a safety factor) instead of always waiting the full 30 s.
+When a host keeps failing, its breaker opens and the scheduler stops sending
+it work until a cool-down has passed; one probe request then decides whether
+the host is healthy again.
+"""
+import time
+import random
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 15  # seconds, doubled on every attempt
+
+
+def retry_delay(attempt, base=RETRY_BASE_DELAY):
+    """Exponential backoff with jitter for the given (1-based) failed attempt"""
+    return base * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+
+
+class AdaptiveTimeout:
+    """Navigation timeout derived from recent latency percentiles"""
+
+    def __init__(self, default_ms=30000, min_ms=8000, max_ms=30000, factor=3.0, window=50, min_samples=5):
+        self.default_ms = default_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.factor = factor
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.samples.append(seconds * 1000)
+
+    def percentile(self, pct):
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+    def current_ms(self):
+        if len(self.samples) < self.min_samples:
+            return self.default_ms
+        return int(min(self.max_ms, max(self.min_ms, self.percentile(95) * self.factor)))
+
+
+class CircuitBreaker:
+    """Closed -> open after `threshold` consecutive failures -> half-open probe after a cool-down"""
+
+    def __init__(self, name, threshold=5, cooldown=60, max_cooldown=600):
+        self.name = name
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.state = 'closed'
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+
+    def ready(self):
+        """Whether allow() would let a request through, without claiming the probe"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self.probing
+
+    def allow(self):
+        """Whether a request may be sent to the host right now"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = 'half_open'
+            logger.info(f"Circuit for {self.name} half-open, sending a probe request")
+        if self.state == 'half_open' and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def wait_time(self):
+        """Seconds until the breaker lets a request through again.
+
+        None while a half-open probe is in flight: only its outcome, not the
+        passage of time, can change the state.
+        """
+        if self.state == 'half_open':
+            return None if self.probing else 0.0
+        if self.state != 'open':
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        if self.state != 'closed':
+            logger.info(f"Circuit for {self.name} closed, host recovered")
+        self.state = 'closed'
+        self.failures = 0
+        self.probing = False
+        self.cooldown = self.base_cooldown
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open':
+            # The probe failed: stay away for longer
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            self._open()
+        elif self.state == 'closed' and self.failures >= self.threshold:
+            self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.probing = False
+        self.trips += 1
+        logger.warning(f"Circuit for {self.name} open after {self.failures} failures, pausing for {self.cooldown}s")
@@ -18,3 +18,91 @@ create table if not exists vehicles (
 
 -- Optional: Create an index on listing_url for faster lookups
 create index if not exists vehicles_listing_url_idx on vehicles (listing_url);
+
+-- Summary statistics served by the API's /stats endpoint.
+-- One row per (dimension, bucket): overall totals, breakdowns by year, trim and
+-- fuel type, and price / mileage histograms. Refreshed at the end of each sync
+-- through the refresh_vehicle_stats() RPC.
+create materialized view if not exists vehicle_stats as
+  select 'total'::text as dimension, 'all'::text as bucket,
+         count(*) as count, min(price) as min_price, max(price) as max_price,
+         round(avg(price), 2) as avg_price, round(avg(mileage)) as avg_mileage
+  from vehicles
+  union all
+  select 'year', coalesce(year::int::text, 'unknown'),
+         count(*), min(price), max(price), round(avg(price), 2), round(avg(mileage))
+  from vehicles group by 2
+  union all
+  select 'trim', coalesce(trim, 'unknown'),
+         count(*), min(price), max(price), round(avg(price), 2), round(avg(mileage))
+  from vehicles group by 2
+  union all
+  select 'fuel_type', coalesce(fuel_type, 'unknown'),
+         count(*), min(price), max(price), round(avg(price), 2), round(avg(mileage))
+  from vehicles group by 2
+  union all
+  -- $5,000 price buckets, labelled by their lower bound
+  select 'price_histogram', (floor(price / 5000) * 5000)::bigint::text,
+         count(*), min(price), max(price), round(avg(price), 2), round(avg(mileage))
+  from vehicles where price is not null group by 2
+  union all
+  -- 20,000 km mileage buckets, labelled by their lower bound
+  select 'mileage_histogram', (floor(mileage / 20000) * 20000)::bigint::text,
+         count(*), min(price), max(price), round(avg(price), 2), round(avg(mileage))
+  from vehicles where mileage is not null group by 2;
+
+-- Required for refresh ... concurrently, so /stats never blocks on a refresh
+create unique index if not exists vehicle_stats_dimension_bucket_idx on vehicle_stats (dimension, bucket);
+
+create or replace function refresh_vehicle_stats() returns void
+language sql security definer as $$
+  refresh materialized view concurrently vehicle_stats;
+$$;
+
+-- Change history per listing: one row per (listing, field) value with the
+-- interval it was valid for. Only changed values are written, so unchanged
+-- listings add nothing on a nightly sync.
+create table if not exists vehicle_history (
+  id bigint generated by default as identity primary key,
+  listing_url text not null,
+  field text not null,
+  value text,
+  valid_from timestamptz not null,
+  valid_to timestamptz -- null while the value is current
+);
+
+-- Per-vehicle time-series reads
+create index if not exists vehicle_history_listing_idx on vehicle_history (listing_url, field, valid_from);
+-- At most one current value per (listing, field). Also used to look up the
+-- current values when recording changes; if two syncs record the same listing
+-- at once (e.g. an expired queue lease re-leased while its first worker is still
+-- saving), the second one fails instead of leaving two open intervals.
+drop index if exists vehicle_history_current_idx;
+create unique index vehicle_history_current_idx on vehicle_history (listing_url, field) where valid_to is null;
+
+-- Record a batch of snapshots (the rows just upserted into vehicles): close the
+-- current interval of every field whose value changed and open a new one.
+-- Returns the number of new intervals. Closing and opening are separate
+-- statements so the unique index never sees a field's old and new interval
+-- open at the same time.
+create or replace function record_vehicle_history(snapshots jsonb, tracked_fields text[]) returns integer
+language sql security definer as $$
+  update vehicle_history h set valid_to = coalesce((s->>'scraped_at')::timestamptz, now())
+  from jsonb_array_elements(snapshots) s, unnest(tracked_fields) f
+  where h.listing_url = s->>'listing_url' and h.field = f and h.valid_to is null
+    and h.value is distinct from s->>f;
+
+  -- Every tracked field now without a current value: the ones just closed and new listings
+  with inserted as (
+    insert into vehicle_history (listing_url, field, value, valid_from)
+    select s->>'listing_url', f, s->>f, coalesce((s->>'scraped_at')::timestamptz, now())
+    from jsonb_array_elements(snapshots) s, unnest(tracked_fields) f
+    where s->>'listing_url' is not null
+      and not exists (
+        select 1 from vehicle_history h
+        where h.listing_url = s->>'listing_url' and h.field = f and h.valid_to is null
+      )
+    returning id
+  )
+  select count(*)::integer from inserted;
+$$;
@@ -0,0 +1,171 @@
+"""
+Crawl worker.
+
+Listing URLs are put on the durable job queue (see job_queue.py) by the
+`enqueue` command; any number of `run` processes, on this machine or others
+sharing the queue backend, then lease batches of URLs, extract them and hand
+the results to save_to_supabase. Jobs are only acked after the batch has been
+saved, so a worker that dies mid-batch loses nothing: its leases expire and
+another worker picks the URLs up.
+
+Usage:
+    python worker.py enqueue
+    python worker.py run [--batch-size 20] [--pages 2]
+    python worker.py stats
+    python worker.py requeue-dead
+"""
+import os
+import uuid
+import socket
+import asyncio
+import logging
+import argparse
+from playwright.async_api import async_playwright
+
+from main import save_to_supabase, refresh_vehicle_stats
+from dealers import load_dealers
+from crawler import TokenBucket
+from metrics import metrics, publish
+from job_queue import open_queue, DEFAULT_VISIBILITY_TIMEOUT, DEFAULT_BACKOFF
+from page_cache import open_cache, store_page
+from playwright_scraper import collect_listing_urls, extract_vehicle_details, has_vehicle_data
+
+QUEUE_NAME = "listings"
+
+
+async def enqueue_listings(queue, dealers=None):
+    """Collect every dealer's listing URLs and put them on the queue"""
+    dealers = dealers or load_dealers()
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        page = await browser.new_page()
+        for dealer in dealers:
+            try:
+                urls = await collect_listing_urls(page, dealer)
+            except Exception as e:
+                logging.error(f"Failed to collect listings for {dealer['name']}: {e}")
+                continue
+            added = queue.enqueue([{'dealer': dealer['name'], 'url': url} for url in urls], queue=QUEUE_NAME)
+            logging.info(f"[{dealer['name']}] Enqueued {added} of {len(urls)} listing URLs")
+        await browser.close()
+
+
+async def _heartbeat(queue, job_ids, worker_id, visibility_timeout):
+    """Keep our leases alive while a batch is being processed"""
+    while True:
+        await asyncio.sleep(visibility_timeout / 3)
+        queue.extend(job_ids, worker_id, visibility_timeout)
+
+
+async def _process_batch(context, jobs, dealers, buckets, pages, cache=None):
+    """Extract every job in the batch over `pages` browser pages.
+
+    Returns (vehicles, done_ids, failures), failures being (job_id, dealer_name, reason, error) tuples.
+    """
+    pending = asyncio.Queue()
+    for job in jobs:
+        pending.put_nowait(job)
+    vehicles, done_ids, failures = [], [], []
+
+    async def run_page():
+        page = await context.new_page()
+        while not pending.empty():
+            job = pending.get_nowait()
+            dealer = dealers.get(job['payload']['dealer'])
+            url = job['payload']['url']
+            if dealer is None:
+                failures.append((job['id'], job['payload']['dealer'], 'unknown_dealer', f"Unknown dealer: {job['payload']['dealer']}"))
+                continue
+            bucket = buckets.setdefault(dealer['host'], TokenBucket(dealer['rate_per_sec'], dealer['burst']))
+            while not bucket.try_acquire():
+                await asyncio.sleep(bucket.wait_time())
+            event = {}
+            vehicle_data = await extract_vehicle_details(page, url, dealer, event)
+            if cache is not None and 'text' in event:
+                store_page(cache, url, event['text'], dealer['name'])
+            if has_vehicle_data(vehicle_data):
+                vehicles.append(vehicle_data)
+                done_ids.append(job['id'])
+            else:
+                reason = event.get('error', 'no_data').split(':')[0]
+                failures.append((job['id'], dealer['name'], reason, event.get('error', "No data extracted")))
+        await page.close()
+
+    await asyncio.gather(*(run_page() for _ in range(pages)))
+    return vehicles, done_ids, failures
+
+
+async def run_worker(queue, batch_size=20, pages=2, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, exit_when_empty=False, poll_interval=30):
+    """Lease, extract and save batches until the queue is empty (or forever)"""
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    dealers = {d['name']: d for d in load_dealers()}
+    buckets = {}
+    cache = open_cache()
+    run_start = metrics.snapshot()
+    saved_since_refresh = False
+    logging.info(f"Worker {worker_id} started")
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        context = await browser.new_context()
+        while True:
+            jobs = queue.lease(worker_id, limit=batch_size, visibility_timeout=visibility_timeout, queue=QUEUE_NAME)
+            if not jobs:
+                if saved_since_refresh:
+                    # The queue has drained: refresh the stats once rather than after every batch
+                    refresh_vehicle_stats()
+                    saved_since_refresh = False
+                if exit_when_empty:
+                    break
+                await asyncio.sleep(poll_interval)
+                continue
+
+            heartbeat = asyncio.create_task(_heartbeat(queue, [j['id'] for j in jobs], worker_id, visibility_timeout))
+            try:
+                vehicles, done_ids, failures = await _process_batch(context, jobs, dealers, buckets, pages, cache)
+            finally:
+                heartbeat.cancel()
+
+            # Only ack once the results are safely stored. A failed save is not the pages' fault, so their
+            # leases are handed back without using up an attempt and the URLs are extracted again later.
+            saved = save_to_supabase(vehicles)
+            if saved:
+                queue.ack(done_ids)
+                saved_since_refresh = saved_since_refresh or bool(vehicles)
+            else:
+                queue.release(done_ids, delay=DEFAULT_BACKOFF)
+                logging.warning(f"Worker {worker_id}: save failed, released {len(done_ids)} jobs for retry")
+            for job_id, dealer_name, reason, error in failures:
+                # Failed attempts are counted by the extractor; the page itself only counts once it is dead-lettered
+                if queue.fail(job_id, error):
+                    metrics.inc('crawl_failures_total', reason=reason, dealer=dealer_name)
+            publish(f"worker-{worker_id}")
+            logging.info(f"Worker {worker_id}: batch of {len(jobs)} -> {len(done_ids) if saved else 0} saved, {len(failures)} failed")
+
+        await browser.close()
+    logging.info(f"Worker {worker_id} finished, queue empty")
+    metrics.log_summary(since=run_start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue-based crawl worker")
+    parser.add_argument("command", choices=["enqueue", "run", "stats", "requeue-dead"])
+    parser.add_argument("--queue-url", help="Queue backend URL (default: CRAWL_QUEUE_URL or sqlite:///crawl_queue.db)")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=2, help="Browser pages per worker process")
+    parser.add_argument("--visibility-timeout", type=int, default=DEFAULT_VISIBILITY_TIMEOUT)
+    parser.add_argument("--exit-when-empty", action="store_true")
+    args = parser.parse_args()
+
+    queue = open_queue(args.queue_url)
+    if args.command == "enqueue":
+        asyncio.run(enqueue_listings(queue))
+    elif args.command == "run":
+        asyncio.run(run_worker(queue, args.batch_size, args.pages, args.visibility_timeout, args.exit_when_empty))
+    elif args.command == "requeue-dead":
+        logging.info(f"Requeued {queue.requeue_dead(queue=QUEUE_NAME)} dead-lettered jobs")
+    print(queue.stats(queue=QUEUE_NAME))
+
+
+if __name__ == "__main__":
+    main()